@@ -1,12 +1,617 @@
 import os
 import subprocess
 import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 import time
+import threading
+import ctypes
+import ctypes.util
+import struct
+from dataclasses import dataclass, replace
 from datetime import datetime
+from typing import Optional
 
 from shiny import App, ui, render, reactive
 
+try:
+    import liburing # Optional: batches log reads through io_uring (pip install liburing==2026.3.30)
+except ImportError:
+    liburing = None
+
+# --- Slurm command runner ---
+# One-shot Slurm commands run in a small process pool, so forking them never stalls the
+# event loop that serves every session, and at most SLURM_CLI_WORKERS run at once.
+SLURM_CLI_WORKERS = 4
+SLURM_CLI_TIMEOUT = 60 # Seconds before a hung Slurm command is killed, freeing its worker
+_executor = ProcessPoolExecutor(max_workers=SLURM_CLI_WORKERS)
+
+def _run_cmd(cmd):
+    """
+    Runs a command in a pool worker and returns (returncode, stdout bytes, stderr bytes).
+    A command that times out is killed and reported with returncode 124, like timeout(1).
+    """
+    try:
+        result = subprocess.run(cmd, capture_output=True, timeout=SLURM_CLI_TIMEOUT)
+    except subprocess.TimeoutExpired as e:
+        return 124, e.stdout or b"", f"{cmd[0]} timed out after {SLURM_CLI_TIMEOUT} seconds".encode()
+    return result.returncode, result.stdout, result.stderr
+
+async def run_cmd(cmd):
+    """
+    Runs a command through the process pool without blocking the event loop.
+    If a worker died and broke the pool, the pool is rebuilt and the command retried once.
+    """
+    global _executor
+    loop = asyncio.get_running_loop()
+    executor = _executor
+    try:
+        return await loop.run_in_executor(executor, _run_cmd, list(cmd))
+    except BrokenProcessPool:
+        if executor is _executor: # Another caller may have rebuilt it already
+            print("Slurm command pool broke (a worker died); starting a new one")
+            executor.shutdown(wait=False)
+            _executor = ProcessPoolExecutor(max_workers=SLURM_CLI_WORKERS)
+        return await loop.run_in_executor(_executor, _run_cmd, list(cmd))
+
+# --- Shared squeue stream ---
+# A single long-lived `squeue --iterate` process reports the state of all of our jobs,
+# so sessions look job state up in a dict instead of each spawning squeue on every poll.
+SQUEUE_INTERVAL = 5 # Seconds between squeue refreshes
+SQUEUE_ITERATION_GAP = 1.0 # squeue prints each iteration in one burst; a pause this long ends it
+# Any state not listed here is treated as final and ends the polling loop
+ACTIVE_STATES = {
+    "PENDING", "CONFIGURING", "RUNNING", "COMPLETING", "SUSPENDED", "STOPPED", "SIGNALING",
+    "STAGE_OUT", "REQUEUED", "REQUEUE_HOLD", "REQUEUE_FED", "RESV_DEL_HOLD", "SPECIAL_EXIT", "RESIZING",
+}
+
+# How long the polling loop waits between checks that spawn squeue/sacct (the job is not in
+# the stream), by job state. Pending jobs tend to stay pending for a while; any other state
+# backs off exponentially up to MAX_POLL_INTERVAL. Stream lookups are free and always run
+# every SQUEUE_INTERVAL.
+POLL_INTERVALS = {"RUNNING": 2.0, "PENDING": 15.0}
+MAX_POLL_INTERVAL = 60.0
+
+# If squeue keeps exiting, restarts back off exponentially up to MAX_SQUEUE_RESTART_DELAY.
+SQUEUE_RESTART_DELAY = 2.0
+MAX_SQUEUE_RESTART_DELAY = 60.0
+SQUEUE_STARTUP_WINDOW = 2.0 # squeue failing this quickly, before any output, rejected its options
+
+_squeue_jobs = {} # job_id -> (state, node) as of the last complete squeue iteration
+_squeue_task = None
+_squeue_started_at = 0.0
+_squeue_restart_at = 0.0 # Earliest time the stream may be started again
+_squeue_restart_delay = SQUEUE_RESTART_DELAY
+_only_job_state = None # Whether squeue supports --only-job-state; detected once
+
+async def _supports_only_job_state():
+    """
+    Checks once whether this squeue has --only-job-state, which answers from
+    slurmctld's job state cache (SchedulerParameters=enable_job_state_cache).
+    """
+    global _only_job_state
+    if _only_job_state is None:
+        _, stdout, _ = await run_cmd(["squeue", "--help"])
+        _only_job_state = b"only-job-state" in stdout
+        print(f"squeue --only-job-state supported: {_only_job_state}")
+    return _only_job_state
+
+async def _squeue_stream():
+    """
+    Runs `squeue --iterate` and records every job line it prints into _squeue_jobs.
+    squeue starts each iteration with a date line; once an iteration is complete, jobs it
+    did not list have left the queue and are dropped. Returns when squeue exits; polling
+    sessions call _ensure_squeue_stream() on every check, which restarts it after a backoff.
+    With --only-job-state the node is not reported; see get_job_node().
+    """
+    global _only_job_state
+    use_state_cache = await _supports_only_job_state()
+    if use_state_cache:
+        squeue_command = ["squeue", "--me", "--only-job-state", "-i", str(SQUEUE_INTERVAL), "--format=%i|%T"]
+    else:
+        squeue_command = ["squeue", "--me", "-i", str(SQUEUE_INTERVAL), "--format=%i|%T|%N"]
+    process = await asyncio.create_subprocess_exec(
+        *squeue_command,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.DEVNULL
+    )
+    started_at = time.monotonic()
+    got_output = False
+    seen = None # Jobs listed by the iteration being read; None between iterations
+    try:
+        while True:
+            try:
+                line = await asyncio.wait_for(process.stdout.readline(), None if seen is None else SQUEUE_ITERATION_GAP)
+            except asyncio.TimeoutError:
+                line = None # squeue is done printing this iteration
+            if line is None or (line.strip() and b"|" not in line):
+                # End of an iteration (a pause, or the date line that starts the next one)
+                if seen is not None:
+                    for gone_id in [j for j in _squeue_jobs if j not in seen]:
+                        del _squeue_jobs[gone_id]
+                seen = None if line is None else set()
+                continue
+            if not line:
+                break # squeue exited
+            got_output = True
+            parts = line.decode().strip().split("|")
+            if len(parts) == 2:
+                parts.append("") # --only-job-state lines carry no node
+            if len(parts) != 3 or parts[0] == "JOBID":
+                continue # Skip the header and blank lines
+            job_id, state, node = parts
+            _squeue_jobs[job_id] = (state, node)
+            if seen is not None:
+                seen.add(job_id)
+    finally:
+        _squeue_jobs.clear() # Nothing keeps these current until the stream restarts
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+        elif (process.returncode != 0 and use_state_cache and not got_output
+              and time.monotonic() - started_at < SQUEUE_STARTUP_WINDOW):
+            # squeue rejected --only-job-state (e.g. combined with --me); restart with the full query.
+            # Later failures (e.g. slurmctld unreachable) keep the option.
+            _only_job_state = False
+        print(f"squeue stream exited with code {process.returncode}")
+
+def _ensure_squeue_stream():
+    """
+    Starts the shared squeue stream if it is not already running and is not backing off
+    after exiting. Must be called from within the event loop.
+    """
+    global _squeue_task, _squeue_started_at
+    if _squeue_task is None or (_squeue_task.done() and time.monotonic() >= _squeue_restart_at):
+        _squeue_started_at = time.monotonic()
+        _squeue_task = asyncio.create_task(_squeue_stream())
+        _squeue_task.add_done_callback(_on_squeue_stream_done)
+
+def _on_squeue_stream_done(task):
+    """
+    Logs why the squeue stream stopped and schedules its restart, backing off while it
+    keeps exiting soon after starting.
+    """
+    global _squeue_restart_at, _squeue_restart_delay
+    if not task.cancelled() and task.exception() is not None: # Retrieving it also silences asyncio's warning
+        print(f"squeue stream failed: {task.exception()!r}")
+    now = time.monotonic()
+    if now - _squeue_started_at > MAX_SQUEUE_RESTART_DELAY:
+        _squeue_restart_delay = SQUEUE_RESTART_DELAY # It ran fine for a while; restart promptly
+    _squeue_restart_at = now + _squeue_restart_delay
+    _squeue_restart_delay = min(MAX_SQUEUE_RESTART_DELAY, _squeue_restart_delay * 2)
+
+def next_poll_interval(job_state, last_interval):
+    """
+    Returns how long to wait before the next check of a job in job_state.
+    """
+    if job_state in POLL_INTERVALS:
+        return POLL_INTERVALS[job_state]
+    return min(MAX_POLL_INTERVAL, last_interval * 1.5)
+
+def lookup_squeue_job(job_id):
+    """
+    Returns (state, node) for a job as last reported by the squeue stream,
+    or None if the job is not (or no longer) in the queue, or the stream isn't running.
+    """
+    return _squeue_jobs.get(job_id)
+
+# --- Cached Slurm commands ---
+# sacct/squeue output is cached briefly so repeated lookups of the same job reuse one subprocess.
+# Each endpoint has a (min, max) freshness window; the TTL stretches when the command is slow.
+SACCT_TTL = (10.0, 30.0) # slurmdbd records change slowly
+SACCT_DELAY = 30 # Seconds to keep retrying an UNKNOWN sacct reply for a job that left the queue
+SQUEUE_TTL = (3.0, 10.0)
+
+_cache = {} # command tuple -> (time stored, stdout, ttl)
+
+async def cached_run(cmd, ttl):
+    """
+    Runs a command and returns its stdout as bytes, reusing the cached output if it is still fresh.
+    Output is left undecoded so callers only decode the fields they need.
+    ttl is a (min, max) tuple; the entry lives for three times the command's runtime, clamped to it.
+    Failed commands are not cached.
+    """
+    now = time.monotonic()
+    cached = _cache.get(cmd)
+    if cached and now - cached[0] < cached[2]:
+        return cached[1]
+
+    returncode, stdout, _ = await run_cmd(cmd)
+    output = stdout.strip()
+
+    if returncode == 0:
+        finished = time.monotonic()
+        min_ttl, max_ttl = ttl
+        # Drop expired entries so finished jobs don't accumulate in the cache
+        for key in [k for k, entry in _cache.items() if finished - entry[0] >= entry[2]]:
+            del _cache[key]
+        _cache[cmd] = (finished, output, min(max((finished - now) * 3, min_ttl), max_ttl))
+    return output
+
+async def get_job_statuses(job_ids):
+    """
+    Looks up the accounting state and node(s) of several jobs with a single sacct call.
+    Returns a dict of job_id -> (state, node); jobs sacct does not know about map to ("UNKNOWN", "").
+    """
+    job_ids = sorted(set(job_ids)) # Stable order so the same set of jobs hits the same cache entry
+    sacct_command = ("sacct", "-j", ",".join(job_ids), "--format=JobID,State,NodeList", "--parsable2", "--noheader")
+    sacct_output = await cached_run(sacct_command, SACCT_TTL)
+
+    # Parse the raw bytes and only decode the fields of the lines we keep
+    wanted = {job_id.encode(): job_id for job_id in job_ids}
+    statuses = dict.fromkeys(job_ids, ("UNKNOWN", ""))
+    for line in sacct_output.split(b"\n"):
+        fields = line.split(b"|", 2)
+        # Skip job steps (e.g. 1234.batch) and keep only the allocation's own line
+        if len(fields) != 3 or fields[0] not in wanted or not fields[1].strip():
+            continue
+        _, state, node = fields
+        if node == b"None assigned": # What sacct reports for jobs that never got a node
+            node = b""
+        # States such as "CANCELLED by 1000" carry extra detail after the state name
+        statuses[wanted[fields[0]]] = (state.split()[0].decode("ascii").upper(), node.strip().decode())
+    return statuses
+
+async def get_job_status(job_id):
+    """
+    Returns (state, node) for one job. Asks slurmctld via squeue first, since sacct lags squeue
+    for jobs that are still queued, and only falls back to sacct once the job has left the queue.
+    """
+    squeue_output = await cached_run(("squeue", "-h", "-j", job_id, "-o", "%T|%N"), SQUEUE_TTL)
+    state, _, node = squeue_output.decode().partition("|")
+    if state:
+        return state, node
+    return (await get_job_statuses([job_id]))[job_id]
+
+async def query_squeue_job(job_id):
+    """
+    Returns (state, node) for a job straight from slurmctld, bypassing the cache,
+    or None if squeue doesn't list it (it left the queue, or squeue failed).
+    Used to confirm a completion wakeup, which a stale cached answer would contradict.
+    """
+    _, stdout, _ = await run_cmd(["squeue", "-h", "-j", job_id, "-o", "%T|%N"])
+    state, _, node = stdout.decode().strip().partition("|")
+    return (state, node) if state else None
+
+async def get_job_node(job_id):
+    """
+    Returns the node(s) a job was allocated, or "" if squeue does not report any.
+    Only needed when the squeue stream runs with --only-job-state.
+    """
+    return (await cached_run(("squeue", "-h", "-j", job_id, "-o", "%N"), SQUEUE_TTL)).decode()
+
+# --- Completion triggers ---
+# strigger makes slurmctld run a hook once when a job finishes. The hook touches a sentinel
+# file in TRIGGER_DIR, which we pick up via inotify (or a stat, for writes inotify can't see
+# on network filesystems), so completion needs no polling of Slurm.
+# strigger runs the hook on the slurmctld host, so TRIGGER_DIR (and TRIGGER_HOOK) must be on a
+# filesystem shared with it; set SHINY_SLURM_TRIGGER_DIR, and optionally SHINY_SLURM_TRIGGER_HOOK,
+# to enable triggers. Without them no trigger is set.
+# Slurm also closes the job's .out file when the job ends, so a close-after-write on it in
+# LOG_DIR wakes the waiter too; the final state is then confirmed with squeue/sacct.
+TRIGGER_DIR = os.environ.get("SHINY_SLURM_TRIGGER_DIR") or None
+TRIGGER_HOOK = None # The script strigger runs; only used together with TRIGGER_DIR
+if TRIGGER_DIR:
+    TRIGGER_HOOK = os.environ.get("SHINY_SLURM_TRIGGER_HOOK") or os.path.join(TRIGGER_DIR, "shiny_job_done.sh")
+SENTINEL_PREFIX = "shiny_done_"
+SENTINEL_MAX_AGE = 600 # Seconds after which a sentinel nobody is waiting for is removed
+LOG_DIR = os.getcwd() # sbatch writes shiny_sleep_job_%j.out relative to the working directory
+LOG_PREFIX = "shiny_sleep_job_"
+LOG_SUFFIX = ".out"
+
+IN_CLOSE_WRITE = 0x00000008
+IN_CREATE = 0x00000100
+INOTIFY_EVENT = struct.Struct("iIII") # wd, mask, cookie, len; followed by the name
+
+_done_events = {} # job_id -> asyncio.Event set when the job's sentinel appears or its .out is closed
+_inotify_fd = None
+
+def _write_trigger_hook():
+    """
+    Writes the script strigger runs when a job finishes. strigger passes the job ID as the last argument.
+    """
+    os.makedirs(TRIGGER_DIR, exist_ok=True)
+    with open(TRIGGER_HOOK, "w") as f:
+        f.write(
+            "#!/bin/sh\n"
+            "# Run by strigger when a Shiny-launched job finishes; the job ID is the last argument.\n"
+            "for job_id; do :; done\n"
+            f'touch "{TRIGGER_DIR}/{SENTINEL_PREFIX}$job_id"\n'
+        )
+    os.chmod(TRIGGER_HOOK, 0o755)
+
+def _sentinel_path(job_id):
+    return os.path.join(TRIGGER_DIR, f"{SENTINEL_PREFIX}{job_id}")
+
+def _sentinel_exists(job_id):
+    return TRIGGER_DIR is not None and os.path.exists(_sentinel_path(job_id))
+
+def _remove_sentinel(job_id):
+    if TRIGGER_DIR is None:
+        return
+    try:
+        os.remove(_sentinel_path(job_id))
+    except FileNotFoundError:
+        pass
+
+def _prune_sentinels():
+    """
+    Removes old sentinel files left behind by jobs whose trigger fired after nobody was waiting any more.
+    """
+    if TRIGGER_DIR is None:
+        return
+    now = time.time()
+    try:
+        names = os.listdir(TRIGGER_DIR)
+    except OSError:
+        return
+    for name in names:
+        if not name.startswith(SENTINEL_PREFIX) or name[len(SENTINEL_PREFIX):] in _done_events:
+            continue
+        path = os.path.join(TRIGGER_DIR, name)
+        try:
+            if now - os.stat(path).st_mtime > SENTINEL_MAX_AGE:
+                os.remove(path)
+        except OSError:
+            pass # Already removed by another worker
+
+def _on_inotify_ready():
+    """
+    Reads pending inotify events and wakes up whoever is waiting on a finished job.
+    """
+    try:
+        data = os.read(_inotify_fd, 4096)
+    except BlockingIOError:
+        return
+    offset = 0
+    while offset + INOTIFY_EVENT.size <= len(data):
+        _, _, _, name_len = INOTIFY_EVENT.unpack_from(data, offset)
+        offset += INOTIFY_EVENT.size
+        name = data[offset:offset + name_len].rstrip(b"\0").decode(errors="replace")
+        offset += name_len
+        if name.startswith(SENTINEL_PREFIX):
+            job_id = name[len(SENTINEL_PREFIX):]
+        elif name.startswith(LOG_PREFIX) and name.endswith(LOG_SUFFIX):
+            job_id = name[len(LOG_PREFIX):-len(LOG_SUFFIX)]
+        else:
+            continue
+        event = _done_events.get(job_id)
+        if event:
+            event.set()
+
+def _ensure_trigger_watch():
+    """
+    Starts watching TRIGGER_DIR (if configured) and LOG_DIR with inotify on the running event loop.
+    Without inotify (non-Linux, or it fails) waiters fall back to checking the sentinel file.
+    """
+    global _inotify_fd
+    if _inotify_fd is not None:
+        return
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        if TRIGGER_DIR is not None and libc.inotify_add_watch(fd, os.fsencode(TRIGGER_DIR), IN_CLOSE_WRITE | IN_CREATE) < 0:
+            os.close(fd)
+            raise OSError(ctypes.get_errno(), "inotify_add_watch failed")
+        # Only IN_CLOSE_WRITE here: the .out file is created when the job starts, not when it ends
+        if libc.inotify_add_watch(fd, os.fsencode(LOG_DIR), IN_CLOSE_WRITE) < 0:
+            print(f"Not watching {LOG_DIR} for finished job output: errno {ctypes.get_errno()}")
+    except (OSError, AttributeError) as e:
+        print(f"inotify unavailable, relying on sentinel checks: {e}")
+        _inotify_fd = -1
+        return
+    _inotify_fd = fd
+    asyncio.get_running_loop().add_reader(fd, _on_inotify_ready)
+
+async def set_completion_trigger(job_id):
+    """
+    Registers a --fini trigger for the job. Returns False if triggers aren't configured or
+    strigger refused it, in which case the caller has to notice completion through squeue/sacct.
+    """
+    _ensure_trigger_watch()
+    _prune_sentinels()
+    _done_events[job_id] = asyncio.Event()
+    if TRIGGER_HOOK is None:
+        return False
+    returncode, _, stderr = await run_cmd(
+        ["strigger", "--set", f"--jobid={job_id}", "--fini", f"--program={TRIGGER_HOOK}"]
+    )
+    if returncode != 0:
+        print(f"strigger failed for job {job_id}: {stderr.decode().strip()}")
+        return False
+    return True
+
+async def wait_for_job_done(job_id, timeout):
+    """
+    Waits up to timeout seconds for the job's completion trigger or its output file being closed.
+    Returns True once either has happened.
+    """
+    if _sentinel_exists(job_id):
+        return True # Catches sentinels written where inotify can't see them (e.g. NFS)
+    event = _done_events.setdefault(job_id, asyncio.Event())
+    try:
+        await asyncio.wait_for(event.wait(), timeout)
+        return True
+    except asyncio.TimeoutError:
+        return _sentinel_exists(job_id)
+
+def rearm_completion_wait(job_id):
+    """
+    Resets a wakeup that turned out to be early (e.g. the .out file closed on requeue),
+    so wait_for_job_done() waits again instead of returning straight away.
+    """
+    event = _done_events.get(job_id)
+    if event:
+        event.clear()
+    _remove_sentinel(job_id)
+
+async def clear_completion_trigger(job_id):
+    """
+    Removes the job's trigger from slurmctld if it hasn't fired yet, then forgets its
+    completion event and removes its sentinel file.
+    """
+    _done_events.pop(job_id, None)
+    _remove_sentinel(job_id)
+    if TRIGGER_HOOK is None:
+        return # No trigger was set
+    try:
+        # Fails harmlessly when the trigger already fired or was never set
+        await run_cmd(["strigger", "--clear", f"--jobid={job_id}"])
+    except Exception as e:
+        print(f"Could not clear strigger for job {job_id}: {e}") # A late sentinel is pruned later
+
+if TRIGGER_HOOK is None:
+    print("SHINY_SLURM_TRIGGER_DIR not set; not using strigger completion triggers")
+else:
+    try:
+        _write_trigger_hook()
+    except OSError as e:
+        print(f"Could not write strigger hook {TRIGGER_HOOK}: {e}") # Completion then falls back to sacct
+
 # --- Helper function to read Slurm output/error files ---
+# Slurm log files only grow, so each read picks up where the previous one stopped.
+_log_state = {} # path -> (inode, bytes read so far, contents read so far)
+
+def _plan_log_read(path):
+    """
+    Returns (offset, size) of the bytes appended to a log file since it was last read.
+    Starts over if the file was replaced or truncated. Raises FileNotFoundError if it doesn't exist.
+    """
+    st = os.stat(path)
+    inode, offset, contents = _log_state.get(path, (None, 0, None))
+    if inode != st.st_ino or st.st_size < offset:
+        inode, offset, contents = st.st_ino, 0, bytearray()
+        _log_state[path] = (inode, offset, contents)
+    return offset, st.st_size - offset
+
+def _finish_log_read(path, chunk):
+    """
+    Appends newly read bytes to a log file's state and returns its full contents.
+    """
+    inode, offset, contents = _log_state[path]
+    contents += chunk
+    _log_state[path] = (inode, offset + len(chunk), contents)
+    return bytes(contents)
+
+def read_log_incremental(path):
+    """
+    Returns the contents of a log file as bytes, reading only what was appended since the last call.
+    Raises FileNotFoundError if it doesn't exist.
+    """
+    offset, size = _plan_log_read(path)
+    chunk = b""
+    if size > 0:
+        with open(path, "rb") as f:
+            f.seek(offset)
+            chunk = f.read(size)
+    return _finish_log_read(path, chunk)
+
+# With liburing installed, the appended bytes of all log files are read in one io_uring
+# submission. SQPOLL lets the kernel pick up submissions without a syscall where permitted.
+# Written against the liburing Python bindings 2026.3.30 (pip install liburing==2026.3.30):
+# Ring/Cqe objects, io_uring_prep_read() into a bytearray, and *_data64 user data.
+URING_ENTRIES = 32
+_ring = None # None: not set up yet; False: io_uring unavailable
+_cqe = None
+_ring_lock = threading.Lock() # Reads run in worker threads; the ring is not thread-safe
+
+def _get_ring():
+    """
+    Sets up the shared io_uring on first use. Returns None if it can't be used.
+    Any failure, including a liburing version with a different API, disables io_uring for good.
+    """
+    global _ring, _cqe
+    if _ring is None:
+        _ring = False
+        if liburing is not None:
+            try:
+                for flags in (liburing.IORING_SETUP_SQPOLL, 0): # SQPOLL may need privileges; retry without
+                    ring = liburing.Ring() # A failed init can leave a ring unusable, so start fresh
+                    try:
+                        liburing.io_uring_queue_init(URING_ENTRIES, ring, flags)
+                    except OSError as e:
+                        print(f"io_uring setup with flags {flags} failed: {e}")
+                        continue
+                    _ring, _cqe = ring, liburing.Cqe()
+                    break
+            except Exception as e:
+                print(f"io_uring unavailable, using regular log reads: {e}")
+                _ring = False
+    return _ring or None
+
+def _read_logs_uring(ring, paths):
+    """
+    Reads the appended bytes of several log files with a single io_uring submission.
+    Returns a list holding each file's contents, or the exception raised for it.
+    """
+    results = [None] * len(paths)
+    pending = {} # index -> (fd, buffer)
+    with _ring_lock:
+        try:
+            for i, path in enumerate(paths):
+                try:
+                    offset, size = _plan_log_read(path)
+                except OSError as e:
+                    results[i] = e
+                    continue
+                if size == 0:
+                    results[i] = _finish_log_read(path, b"")
+                    continue
+                try:
+                    fd = os.open(path, os.O_RDONLY)
+                except OSError as e:
+                    results[i] = e # e.g. deleted since the stat; only this file fails
+                    continue
+                buffer = bytearray(size)
+                pending[i] = (fd, buffer)
+                sqe = liburing.io_uring_get_sqe(ring)
+                liburing.io_uring_prep_read(sqe, fd, buffer, offset)
+                liburing.io_uring_sqe_set_data64(sqe, i)
+
+            if pending:
+                liburing.io_uring_submit(ring)
+                for _ in range(len(pending)):
+                    liburing.io_uring_wait_cqe(ring, _cqe)
+                    cqe = _cqe[0]
+                    i, res = liburing.io_uring_cqe_get_data64(cqe), cqe.res
+                    liburing.io_uring_cqe_seen(ring, cqe)
+                    if res < 0:
+                        results[i] = OSError(-res, os.strerror(-res))
+                    else:
+                        results[i] = _finish_log_read(paths[i], bytes(pending[i][1][:res]))
+        finally:
+            for fd, _ in pending.values():
+                os.close(fd)
+    return results
+
+async def read_logs(paths):
+    """
+    Returns the current contents of several log files, reading only appended bytes.
+    Each entry is the file's bytes, or the exception raised while reading it.
+    The reads run in worker threads, concurrently when io_uring isn't available.
+    """
+    global _ring
+    ring = _get_ring()
+    if ring:
+        try:
+            return await asyncio.to_thread(_read_logs_uring, ring, paths)
+        except Exception as e:
+            print(f"io_uring log read failed, falling back to regular reads: {e}")
+            _ring = False
+
+    return await asyncio.gather(
+        *(asyncio.to_thread(read_log_incremental, path) for path in paths),
+        return_exceptions=True
+    )
+
+def forget_log(path):
+    """
+    Drops the incremental read state of a log file, e.g. once it has been deleted.
+    """
+    _log_state.pop(path, None)
+
 async def read_slurm_logs(job_id):
     """
     Reads the .out and .err files for a given Slurm job ID and returns their content.
@@ -15,26 +620,21 @@ async def read_slurm_logs(job_id):
     stdout_file = f"shiny_sleep_job_{job_id}.out"
     stderr_file = f"shiny_sleep_job_{job_id}.err"
     
-    output_content = ""
-    error_content = ""
+    output_result, error_result = await read_logs([stdout_file, stderr_file])
 
-    try:
-        if os.path.exists(stdout_file):
-            with open(stdout_file, "r") as f:
-                output_content = f.read()
-        else:
-            output_content = f"(Output file '{stdout_file}' not found.)"
-    except Exception as e:
-        output_content = f"(Could not read output file '{stdout_file}': {e})"
+    if isinstance(output_result, FileNotFoundError):
+        output_content = f"(Output file '{stdout_file}' not found.)"
+    elif isinstance(output_result, Exception):
+        output_content = f"(Could not read output file '{stdout_file}': {output_result})"
+    else:
+        output_content = output_result.decode(errors="replace")
 
-    try:
-        if os.path.exists(stderr_file):
-            with open(stderr_file, "r") as f:
-                error_content = f.read()
-        else:
-            error_content = f"(Error file '{stderr_file}' not found.)"
-    except Exception as e:
-        error_content = f"(Could not read error file '{stderr_file}': {e})"
+    if isinstance(error_result, FileNotFoundError):
+        error_content = f"(Error file '{stderr_file}' not found.)"
+    elif isinstance(error_result, Exception):
+        error_content = f"(Could not read error file '{stderr_file}': {error_result})"
+    else:
+        error_content = error_result.decode(errors="replace")
 
     return (
         f"--- Slurm Job {job_id} Standard Output ---\n"
@@ -44,6 +644,49 @@ async def read_slurm_logs(job_id):
         f"-----------------------------------------"
     )
 
+# --- Reactive helpers ---
+def set_if_changed(value, new_value):
+    """
+    Sets a reactive value only if it differs from the current one, so polls that find
+    nothing new don't make Shiny re-render the outputs that depend on it.
+    """
+    if value.get() != new_value:
+        value.set(new_value)
+
+# --- Slurm job ---
+# The job's commands are handed to sbatch with --wrap, so no script file is written.
+# IMPORTANT: The --output and --error paths here must match what read_slurm_logs expects.
+# We are setting them to the current directory here.
+JOB_COMMAND = (
+    'echo "Slurm job started on $(hostname) at $(date)"; '
+    'sleep 30; '
+    'echo "Slurm job finished on $(hostname) at $(date)"'
+)
+SBATCH_OPTIONS = [
+    "--job-name=ShinyEmbeddedJob",
+    "--output=shiny_sleep_job_%j.out", # Output to current directory
+    "--error=shiny_sleep_job_%j.err", # Error to current directory
+    "--time=0-00:01:00", # 1 minute max run time
+    "--ntasks=1",
+    "--nodes=1",
+]
+
+# --- Job state ---
+@dataclass(frozen=True)
+class JobState:
+    """
+    What the UI shows about a session's job. Frozen so updates go through replace()
+    and set_if_changed() can skip values that compare equal.
+    """
+    __slots__ = ("status", "start_time", "end_time", "job_id", "hostname")
+    status: str # One of "No job launched", "Job running", "Job completed"
+    start_time: Optional[datetime]
+    end_time: Optional[datetime]
+    job_id: Optional[str]
+    hostname: str
+
+NO_JOB = JobState(status="No job launched", start_time=None, end_time=None, job_id=None, hostname="N/A")
+
 # --- Shiny UI ---
 app_ui = ui.page_fluid(
     ui.h2("Slurm Job Launcher"),
@@ -60,42 +703,18 @@ app_ui = ui.page_fluid(
 
 # --- Shiny Server Logic ---
 def server(input, output, session):
-    job_info = reactive.Value({
-        "status": "No job launched", # This will be one of "No job launched", "Job running", "Job completed"
-        "start_time": None,
-        "end_time": None,
-        "job_id": None,
-        "hostname": "N/A" # Initialize hostname
-    })
+    job_info = reactive.Value(NO_JOB)
     job_output_content = reactive.Value("")
 
-    # Define the Slurm job script content directly in Python
-    # IMPORTANT: The --output and --error paths here must match what read_slurm_logs expects.
-    # We are setting them to the current directory here.
-    job_script_template = """#!/bin/bash
-#SBATCH --job-name=ShinyEmbeddedJob
-#SBATCH --output=shiny_sleep_job_%j.out   # Output to current directory
-#SBATCH --error=shiny_sleep_job_%j.err    # Error to current directory
-#SBATCH --time=0-00:01:00  # 1 minute max run time
-#SBATCH --ntasks=1
-#SBATCH --nodes=1
-
-echo "Slurm job started on $(hostname) at $(date)"
-sleep 30
-echo "Slurm job finished on $(hostname) at $(date)"
-"""
-
     @output
     @render.text
     def job_status_display():
         info = job_info.get()
-        status = info["status"]
-        hostname = info["hostname"]
         
-        if status == "Job running":
-            return f"Job running on host: {hostname}"
-        elif status == "Job completed":
-            duration = info["end_time"] - info["start_time"]
+        if info.status == "Job running":
+            return f"Job running on host: {info.hostname}"
+        elif info.status == "Job completed":
+            duration = (info.end_time - info.start_time).total_seconds()
             return f"Job Completed in {duration:.2f} seconds."
         # For all other states (No job launched, Launching, Pending, Error),
         # always display "No job launched" in the status bar.
@@ -112,93 +731,86 @@ echo "Slurm job finished on $(hostname) at $(date)"
     @reactive.event(input.launch_job)
     async def _():
         # Reset job_info to "No job launched" before starting
-        job_info.set({"status": "No job launched", "start_time": None, "end_time": None, "job_id": None, "hostname": "N/A"})
-        job_output_content.set("Attempting to launch Slurm job...")
+        set_if_changed(job_info, NO_JOB)
+        set_if_changed(job_output_content, "Attempting to launch Slurm job...")
 
-        script_dir = os.path.dirname(os.path.abspath(__file__))
-        job_script_path = os.path.join(script_dir, "shiny_generated_job.sh") # New name for the generated script
-        
         current_job_id = None # Initialize to None
 
         try:
-            # Write the embedded script content to a file
-            with open(job_script_path, "w") as f:
-                f.write(job_script_template)
-            
-            # Make the script executable
-            os.chmod(job_script_path, 0o755)
-
-            sbatch_command = ["sbatch", "--parsable", job_script_path]
+            _ensure_squeue_stream()
+
+            sbatch_command = ["sbatch", "--parsable", *SBATCH_OPTIONS, f"--wrap={JOB_COMMAND}"]
             print(f"Executing: {' '.join(sbatch_command)}")
 
-            process = await asyncio.create_subprocess_exec(
-                *sbatch_command,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE
-            )
-            stdout, stderr = await process.communicate()
+            returncode, stdout, stderr = await run_cmd(sbatch_command)
 
-            if process.returncode == 0:
+            if returncode == 0:
                 current_job_id = stdout.decode().strip() # Store the job ID
                 print(f"Slurm job submitted with ID: {current_job_id}")
 
                 # Update job_info with the current job ID
-                job_info.set({
-                    "status": "No job launched", # job_status_display remains "No job launched"
-                    "start_time": datetime.now(),
-                    "end_time": None,
-                    "job_id": current_job_id,
-                    "hostname": "N/A" # Still N/A until it runs
-                })
-                job_output_content.set(f"Slurm job ID: {current_job_id}\nJob status: Pending.\nPolling for job completion and node information...")
-
-                # Polling for job completion and node info
+                # job_status_display remains "No job launched"; hostname stays N/A until it runs
+                set_if_changed(job_info, replace(NO_JOB, start_time=datetime.now(), job_id=current_job_id))
+                set_if_changed(job_output_content, f"Slurm job ID: {current_job_id}\nJob status: Pending.\nPolling for job completion and node information...")
+
+                # Completion is signalled by an strigger hook; the loop below only refreshes the
+                # display from the shared squeue stream, which costs no Slurm RPCs.
+                await set_completion_trigger(current_job_id)
+                job_done = False
+                last_seen_at = time.monotonic() # Last time any source reported the job as active
                 last_known_hostname = "N/A"
+                poll_interval = float(SQUEUE_INTERVAL)
                 while True:
-                    # Check job state and assigned node
-                    check_command = ["squeue", "-h", "-j", current_job_id, "-o", "%T %N"] # Get state and node
-                    check_process = await asyncio.create_subprocess_exec(
-                        *check_command,
-                        stdout=asyncio.subprocess.PIPE,
-                        stderr=asyncio.subprocess.PIPE
-                    )
-                    check_stdout, check_stderr = await check_process.communicate()
-                    squeue_output = check_stdout.decode().strip()
-
-                    job_state = ""
-                    current_hostname = "N/A"
-
-                    if squeue_output:
-                        parts = squeue_output.split(maxsplit=1)
-                        job_state = parts[0]
-                        if len(parts) > 1:
-                            current_hostname = parts[1].strip()
-                            last_known_hostname = current_hostname # Update last known
+                    _ensure_squeue_stream() # Restarts the stream if squeue exited (e.g. --only-job-state rejected)
+
+                    # Check job state and assigned node as last reported by the shared squeue stream
+                    squeue_entry = None if job_done else lookup_squeue_job(current_job_id)
+                    if squeue_entry:
+                        job_state, current_hostname = squeue_entry
+                    elif job_done:
+                        # Woken by the trigger or the .out file closing; confirm with an uncached squeue,
+                        # since cached output may predate the job's end
+                        live_entry = await query_squeue_job(current_job_id)
+                        if live_entry and live_entry[0] in ACTIVE_STATES:
+                            # Woken before the job actually ended (e.g. requeued); go back to following the stream
+                            job_done = False
+                            rearm_completion_wait(current_job_id)
+                        job_state, current_hostname = live_entry or (await get_job_statuses([current_job_id]))[current_job_id]
+                    else:
+                        # Not in the stream (not picked up yet, finished, or the stream is restarting);
+                        # ask slurmctld directly, and slurmdbd once the job has left the queue
+                        job_state, current_hostname = await get_job_status(current_job_id)
+                    if job_state in ACTIVE_STATES:
+                        last_seen_at = time.monotonic() # From the stream, squeue or sacct alike
+                    if not squeue_entry and (
+                        (job_done and job_state in ACTIVE_STATES) # Left the queue, but slurmdbd still has it running
+                        or (job_state == "UNKNOWN" and time.monotonic() - last_seen_at < SACCT_DELAY)
+                    ):
+                        # slurmdbd hasn't recorded the job that just left the queue yet; retry, backing off
+                        poll_interval = next_poll_interval(None, poll_interval)
+                        await asyncio.sleep(poll_interval)
+                        continue
+
+                    if current_hostname:
+                        last_known_hostname = current_hostname # Update last known
+                    elif job_state == "RUNNING" and last_known_hostname == "N/A":
+                        # The state-only stream has no node; fetch it once when the job starts running
+                        last_known_hostname = await get_job_node(current_job_id) or "N/A"
                     
                     if job_state == "RUNNING":
-                        job_info.set({
-                            "status": "Job running", # Updates job_status_display
-                            "start_time": job_info.get()["start_time"] if job_info.get()["start_time"] else datetime.now(), # Ensure start_time is set
-                            "end_time": None,
-                            "job_id": current_job_id,
-                            "hostname": last_known_hostname if last_known_hostname != "N/A" else "Unknown Node"
-                        })
-                        job_output_content.set(f"Slurm job ID: {current_job_id}\nCurrently running on: {job_info.get()['hostname']}\nMonitoring job status and output...")
+                        set_if_changed(job_info, replace(
+                            job_info.get(),
+                            status="Job running", # Updates job_status_display
+                            start_time=job_info.get().start_time or datetime.now(), # Ensure start_time is set
+                            hostname=last_known_hostname if last_known_hostname != "N/A" else "Unknown Node"
+                        ))
+                        set_if_changed(job_output_content, f"Slurm job ID: {current_job_id}\nCurrently running on: {job_info.get().hostname}\nMonitoring job status and output...")
                     elif job_state == "PENDING":
                         # job_status_display stays "No job launched"
-                        job_output_content.set(f"Slurm job ID: {current_job_id}\nJob status: Pending. Waiting for allocation...")
-                    elif not job_state: # Job no longer in squeue, check sacct for final state
-                        sacct_command = ["sacct", "-j", current_job_id, "--format=State", "-n", "-P"]
-                        sacct_process = await asyncio.create_subprocess_exec(
-                            *sacct_command,
-                            stdout=asyncio.subprocess.PIPE,
-                            stderr=asyncio.subprocess.PIPE
-                        )
-                        sacct_stdout, sacct_stderr = await sacct_process.communicate()
-                        
-                        final_state_raw = sacct_stdout.decode().strip()
-                        # Extract the first pipe-separated field and clean it thoroughly
-                        final_state = final_state_raw.split('|')[0].strip().upper() if final_state_raw else "UNKNOWN"
+                        set_if_changed(job_output_content, f"Slurm job ID: {current_job_id}\nJob status: Pending. Waiting for allocation...")
+                    elif job_state not in ACTIVE_STATES: # Job finished; squeue/sacct reported its final state
+                        # Never inferred from COMPLETING, which failed and cancelled jobs pass through too
+                        final_state = job_state
 
                         print(f"DEBUG: Job {current_job_id} final_state extracted: '{final_state}' (repr: {repr(final_state)})") # For debugging
 
@@ -206,62 +818,56 @@ echo "Slurm job finished on $(hostname) at $(date)"
                         logs_combined_content = await read_slurm_logs(current_job_id)
 
                         if final_state == "COMPLETED":
-                            job_info.set({
-                                "status": "Job completed", # Updates job_status_display
-                                "start_time": job_info.get()["start_time"],
-                                "end_time": datetime.now(),
-                                "job_id": current_job_id,
-                                "hostname": last_known_hostname
-                            })
-                            job_output_content.set(f"Slurm job {current_job_id} completed successfully.\n\n{logs_combined_content}")
+                            set_if_changed(job_info, replace(
+                                job_info.get(),
+                                status="Job completed", # Updates job_status_display
+                                end_time=datetime.now(),
+                                hostname=last_known_hostname
+                            ))
+                            set_if_changed(job_output_content, f"Slurm job {current_job_id} completed successfully.\n\n{logs_combined_content}")
                         # Check for known failure/termination states
                         elif final_state in ["FAILED", "CANCELLED", "TIMEOUT", "NODE_FAIL", "PREEMPTED", "OUT_OF_MEMORY"]:
-                            job_info.set({
-                                "status": "No job launched", # Resets job_status_display to default
-                                "start_time": job_info.get()["start_time"],
-                                "end_time": datetime.now(),
-                                "job_id": current_job_id,
-                                "hostname": last_known_hostname
-                            })
-                            job_output_content.set(f"Slurm job {current_job_id} ended with state: {final_state}.\n\n{logs_combined_content}")
+                            set_if_changed(job_info, replace(
+                                job_info.get(),
+                                status="No job launched", # Resets job_status_display to default
+                                end_time=datetime.now(),
+                                hostname=last_known_hostname
+                            ))
+                            set_if_changed(job_output_content, f"Slurm job {current_job_id} ended with state: {final_state}.\n\n{logs_combined_content}")
                         else: # Any other truly unexpected or unknown state
-                            job_info.set({
-                                "status": "No job launched", # Resets job_status_display to default
-                                "start_time": job_info.get()["start_time"],
-                                "end_time": datetime.now(),
-                                "job_id": current_job_id,
-                                "hostname": last_known_hostname
-                            })
-                            job_output_content.set(f"Slurm job {current_job_id} ended in unexpected state: {final_state}. "
+                            set_if_changed(job_info, replace(
+                                job_info.get(),
+                                status="No job launched", # Resets job_status_display to default
+                                end_time=datetime.now(),
+                                hostname=last_known_hostname
+                            ))
+                            set_if_changed(job_output_content, f"Slurm job {current_job_id} ended in unexpected state: {final_state}. "
                                                   f"Please check Slurm logs directly on the cluster for job ID {current_job_id} and consult `sacct -j {current_job_id}`.\n\n{logs_combined_content}")
                         break # Exit polling loop
 
-                    # If not in a final state, wait a bit and re-check.
-                    await asyncio.sleep(5) # Poll every 5 seconds
+                    # If not in a final state, wait for the trigger or the next check.
+                    if squeue_entry:
+                        poll_interval = float(SQUEUE_INTERVAL) # Follow the stream; backoff restarts if it loses the job
+                    else:
+                        poll_interval = next_poll_interval(job_state, poll_interval)
+                    job_done = await wait_for_job_done(current_job_id, poll_interval)
 
             else:
                 error_message = stderr.decode().strip()
-                job_info.set({"status": "No job launched", "start_time": None, "end_time": None, "job_id": None, "hostname": "N/A"})
-                job_output_content.set(f"Failed to submit Slurm job:\n{error_message}")
+                set_if_changed(job_info, NO_JOB)
+                set_if_changed(job_output_content, f"Failed to submit Slurm job:\n{error_message}")
 
         except Exception as e:
-            job_info.set({"status": "No job launched", "start_time": None, "end_time": None, "job_id": None, "hostname": "N/A"})
-            job_output_content.set(f"An unexpected error occurred: {e}")
+            set_if_changed(job_info, NO_JOB)
+            set_if_changed(job_output_content, f"An unexpected error occurred: {e}")
         finally:
-            # Clean up the generated job script file
-            if os.path.exists(job_script_path):
-                try:
-                    os.remove(job_script_path)
-                    print(f"Cleaned up generated job script: {job_script_path}")
-                except Exception as e:
-                    print(f"Error cleaning up {job_script_path}: {e}")
-            
             # Clean up the .out and .err files if a job ID was successfully obtained
             if current_job_id:
                 output_file = f"shiny_sleep_job_{current_job_id}.out"
                 error_file = f"shiny_sleep_job_{current_job_id}.err"
                 
                 for f in [output_file, error_file]:
+                    forget_log(f)
                     if os.path.exists(f):
                         try:
                             os.remove(f)
@@ -269,6 +875,9 @@ echo "Slurm job finished on $(hostname) at $(date)"
                         except Exception as e:
                             print(f"Error cleaning up {f}: {e}")
 
+                # Last, as it awaits strigger and the session may be shutting down
+                await clear_completion_trigger(current_job_id)
+
 
 # --- Create the Shiny App instance ---
 app = App(app_ui, server)
\ No newline at end of file